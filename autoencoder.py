@@ -175,21 +175,14 @@ class AttnBlock(nn.Module):
         k = self.k(h_)
         v = self.v(h_)
 
-        # compute attention
+        # compute attention, single head: b,c,h,w -> b,1,hw,c
         b, c, h, w = q.shape
-        q = q.reshape(b, c, h * w)
-        q = q.permute(0, 2, 1)  # b,hw,c
-        k = k.reshape(b, c, h * w)  # b,c,hw
-        w_ = torch.bmm(q, k)  # b,hw,hw    w[b,i,j]=sum_c q[b,i,c]k[b,c,j]
-        w_ = w_ * (int(c)**(-0.5))
-        w_ = torch.nn.functional.softmax(w_, dim=2)
-
-        # attend to values
-        v = v.reshape(b, c, h * w)
-        w_ = w_.permute(0, 2, 1)  # b,hw,hw (first hw of k, second of q)
-        h_ = torch.bmm(
-            v, w_)  # b, c,hw (hw of q) h_[b,c,j] = sum_i v[b,c,i] w_[b,i,j]
-        h_ = h_.reshape(b, c, h, w)
+        q, k, v = (t.reshape(b, 1, c, h * w).transpose(-1, -2).contiguous()
+                   for t in (q, k, v))
+
+        # attend to values, sdpa scales by c**-0.5
+        h_ = F.scaled_dot_product_attention(q, k, v)  # b,1,hw,c
+        h_ = h_.transpose(-1, -2).reshape(b, c, h, w)
 
         h_ = self.proj_out(h_)
 
@@ -10,6 +10,17 @@ def _i(tensor, t, x):
     return tensor.to(t.device)[t].view(shape).to(x)
 
 
+def _cat_guidance_kwargs(model_kwargs):
+    r"""Merge [conditional, non-conditional] kwargs into one dict batched along dim 0.
+    """
+    assert isinstance(model_kwargs, list) and len(model_kwargs) == 2
+    y_kwargs, u_kwargs = model_kwargs
+    return {
+        k: torch.cat([v, u_kwargs[k]]) if torch.is_tensor(v) else v
+        for k, v in y_kwargs.items()
+    }
+
+
 def beta_schedule(schedule,
                   num_timesteps=1000,
                   init_beta=None,
@@ -49,7 +60,7 @@ class GaussianDiffusion(nn.Module):
             'mse', 'rescaled_mse', 'kl', 'rescaled_kl', 'l1', 'rescaled_l1',
             'charbonnier'
         ]
-        self.betas = betas
+        self.register_buffer('betas', betas)
         self.num_timesteps = len(betas)
         self.mean_type = mean_type
         self.var_type = var_type
@@ -100,11 +111,12 @@ class GaussianDiffusion(nn.Module):
         if guide_scale is None:
             out = model(xt, self._scale_timesteps(t), **model_kwargs)
         else:
-            # classifier-free guidance
+            # classifier-free guidance, conditional and non-conditional in one batched forward
             # (model_kwargs[0]: conditional kwargs; model_kwargs[1]: non-conditional kwargs)
-            assert isinstance(model_kwargs, list) and len(model_kwargs) == 2
-            y_out = model(xt, self._scale_timesteps(t), **model_kwargs[0])
-            u_out = model(xt, self._scale_timesteps(t), **model_kwargs[1])
+            if isinstance(model_kwargs, list):
+                model_kwargs = _cat_guidance_kwargs(model_kwargs)
+            y_out, u_out = model(torch.cat([xt, xt]), self._scale_timesteps(torch.cat([t, t])),
+                                 **model_kwargs).chunk(2, dim=0)
             dim = y_out.size(1) if self.var_type.startswith(
                 'fixed') else y_out.size(1) // 2
             a = u_out[:, :dim]
@@ -209,6 +221,9 @@ class GaussianDiffusion(nn.Module):
         # prepare input
         b = noise.size(0)
         xt = noise
+        if guide_scale is not None and isinstance(model_kwargs, list):
+            # batch the guidance kwargs once rather than every step
+            model_kwargs = _cat_guidance_kwargs(model_kwargs)
 
         # diffusion process (TODO: clamp is inaccurate! Consider replacing the stride by explicit prev/next steps)
         steps = (1 + torch.arange(0, self.num_timesteps,
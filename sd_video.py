@@ -1,5 +1,7 @@
 import os
 import json
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any
 
 import torch
@@ -18,11 +20,28 @@ from diffusion import GaussianDiffusion, beta_schedule
 from PIL import Image
 import torchvision.utils as vutils
 import torchvision.transforms.functional as TF
+from torchvision.io import read_image, ImageReadMode
+
+# compile the UNet blocks, VAE decoder, noise preparation and uint8 conversion with torch.compile when running on CUDA
+ENABLE_TORCH_COMPILATION = True
+
+# number of prompt embeddings kept by SDVideo.preprocess
+TEXT_EMB_CACHE_SIZE = 64
+
 class SDVideo:
     def __init__(self, model_path: str, device: str | torch.device = torch.device('cpu')):
         #TODO fix the loading and progress bars
         print("Loading model into memory...")
         self.device = torch.device(device)
+        # TF32 matmuls/convs on Ampere+, and let cuDNN autotune for the fixed latent/decode shapes
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.backends.cudnn.benchmark = True
+        # half precision weights on GPU, bf16 where supported (Ampere+)
+        if self.device.type == 'cuda':
+            self.dtype = torch.bfloat16 if torch.cuda.get_device_capability(self.device)[0] >= 8 else torch.float16
+        else:
+            self.dtype = torch.float32
         with open(os.path.join(model_path, 'configuration.json'), 'r') as f:
             self.config: dict[str, Any] = json.load(f)
         cfg = self.config['model']['model_cfg']
@@ -43,12 +62,22 @@ class SDVideo:
                 dropout = cfg['unet_dropout'],
                 temporal_attention = cfg['temporal_attention']
         )
+        # memory-map the checkpoint and assign its tensors as the parameters, no intermediate copy
+        unet_ckpt = os.path.join(model_path, self.config['model']['model_args']['ckpt_unet'])
+        if unet_ckpt.endswith('.safetensors'):
+            from safetensors.torch import load_file
+            unet_state_dict = load_file(unet_ckpt, device=str(self.device))
+        else:
+            unet_state_dict = torch.load(unet_ckpt, map_location='cpu', mmap=True, weights_only=True)
         self.unet.load_state_dict(
-                torch.load(os.path.join(model_path, self.config['model']['model_args']['ckpt_unet'])),
-                strict = True
+                unet_state_dict,
+                strict = True,
+                assign = True
         )
+        del unet_state_dict
         self.unet = self.unet.eval().requires_grad_(False)
-        self.unet.to(self.device)
+        self.unet.to(self.device, dtype=self.dtype)
+        self.unet.to_channels_last()
 
         betas = beta_schedule(
                 'linear_sd',
@@ -63,6 +92,8 @@ class SDVideo:
                 loss_type = cfg['loss_type'],
                 rescale_timesteps = False
         )
+        # keep the schedule buffers on device so DDIM steps don't copy them over every call
+        self.diffusion.to(self.device)
 
         ddconfig = {
                 'double_z': True,
@@ -82,21 +113,41 @@ class SDVideo:
                 os.path.join(model_path, self.config['model']['model_args']['ckpt_autoencoder'])
         )
         self.vae = self.vae.eval().requires_grad_(False)
-        self.vae.to(self.device)
+        self.vae.to(self.device, dtype=self.dtype, memory_format=torch.channels_last)
 
         self.text_encoder: FrozenOpenCLIPEmbedder = FrozenOpenCLIPEmbedder(
                 version = os.path.join(model_path, self.config['model']['model_args']['ckpt_clip']),
                 layer = 'penultimate'
         )
         self.text_encoder = self.text_encoder.eval().requires_grad_(False)
-        self.text_encoder.to(self.device)
+        self.text_encoder.to(self.device, dtype=self.dtype)
+
+        # text embeddings by prompt, least recently used first
+        self._emb_cache: OrderedDict[str, torch.Tensor] = OrderedDict()
+
+        # draws the initial noise directly on the model device, reseeded at the start of every process() call
+        self._gen = torch.Generator(device=self.device)
+
+        # writes noise previews off the main thread
+        self._preview_executor = ThreadPoolExecutor(max_workers=1)
+        self._preview_future: Future | None = None
+
+        # set when vae.decode is compiled, so decode_latents keeps its input shape fixed
+        self._vae_compiled = False
 
-    def __call__(self, text: str, text_neg: str = '', max_frames: int = 16, initial_alpha: float = 0.23, ratio: float = 0.8, image_path: str = "input.png", output_file_path: str = "output.webm", fps: int = 24) -> str:
+        if ENABLE_TORCH_COMPILATION and torch.cuda.is_available() and self.device.type == 'cuda':
+            print("Compiling model...")
+            self.unet.compile_repeated_blocks(mode="reduce-overhead", fullgraph=True)
+            self.vae.decode = torch.compile(self.vae.decode, mode="max-autotune", fullgraph=True)
+            self._vae_compiled = True
+            self._prepare_noise = torch.compile(self._prepare_noise, mode="reduce-overhead", fullgraph=True, dynamic=False)
+
+    def __call__(self, text: str, text_neg: str = '', max_frames: int = 16, initial_alpha: float = 0.23, ratio: float = 0.8, image_path: str = "input.png", output_file_path: str = "output.webm", fps: int = 24, save_previews: bool = False, seed: int | None = None, decode_chunk_size: int = 4) -> str:
         #print("Preprocessing...")
         text_emb, text_emb_neg = self.preprocess(text, text_neg)
         
         print("Processing: "+text)
-        y = self.process(text_emb, text_emb_neg, image_path, initial_alpha, ratio, max_frames)
+        y = self.process(text_emb, text_emb_neg, image_path, initial_alpha, ratio, max_frames, decode_chunk_size=decode_chunk_size, save_previews=save_previews, seed=seed)
         
         #print("Postprocessing...")
         out = self.postprocess(y)
@@ -106,31 +157,52 @@ class SDVideo:
         return "complete"
 
     def preprocess(self, text: str, text_neg: str = '') -> tuple[torch.Tensor, torch.Tensor]:
-        text_emb = self.text_encoder(tqdm([text], desc="Encoding text", ncols=100))
-        text_emb_neg = self.text_encoder(tqdm([text_neg], desc="Encoding negative text", ncols=100))
+        text_emb = self._encode_text(text, "Encoding text")
+        text_emb_neg = self._encode_text(text_neg, "Encoding negative text")
         return text_emb, text_emb_neg
 
-    def postprocess(self, x: torch.Tensor) -> dict[str, list[np.ndarray]]:
+    def _encode_text(self, text: str, desc: str) -> torch.Tensor:
+        if text in self._emb_cache:
+            self._emb_cache.move_to_end(text)
+            return self._emb_cache[text]
+        text_emb = self.text_encoder(tqdm([text], desc=desc, ncols=100))
+        self._emb_cache[text] = text_emb
+        if len(self._emb_cache) > TEXT_EMB_CACHE_SIZE:
+            self._emb_cache.popitem(last=False)
+        return text_emb
+
+    def postprocess(self, x: torch.Tensor) -> torch.Tensor:
         return tensor2vid(x)
     
-    #needs to return tensor of shape (1, 4, self.max_frames, latent_w, latent_h)
-    def preprocess_image_RGB(self, image_path, output_size, device, max_frames: int = 16):
-        image = Image.open(image_path).convert('RGB')
-        image = image.resize(output_size)
-        image = TF.to_tensor(image).unsqueeze(0)
+    #needs to return tensor of shape (1, 4, self.max_frames, latent_h, latent_w)
+    def preprocess_image_RGB(self, image_path: str | np.ndarray | Image.Image, output_size, device, max_frames: int = 16):
+        # accepts a file path, a PIL image or an (h, w, 3) uint8 array, as a uint8 (c, h, w) tensor
+        if isinstance(image_path, np.ndarray):
+            image = torch.from_numpy(image_path).permute(2, 0, 1)
+        elif isinstance(image_path, Image.Image):
+            image = TF.pil_to_tensor(image_path.convert('RGB'))
+        else:
+            try:
+                image = read_image(image_path, mode=ImageReadMode.RGB)
+            except RuntimeError:
+                # formats torchvision can't decode (BMP, TIFF, ...) go through PIL
+                image = TF.pil_to_tensor(Image.open(image_path).convert('RGB'))
+
+        # resize on device, output_size is (w, h)
+        latent_w, latent_h = output_size
+        image = TF.resize(image.to(device), [latent_h, latent_w], interpolation=TF.InterpolationMode.BICUBIC, antialias=True)
+        image = (image.float() / 255.0).unsqueeze(0)
         
         #TODO: no matter what order the channels, the green is always red
         image = image[:, [0,1,2], :, :]
 
-        latent_w, latent_h = output_size
-        final_tensor = torch.zeros((1, 4, max_frames, latent_w, latent_h), device=device)
-        
-        for j in range(max_frames):  # self.max_frames frames
-            final_tensor[0, :3, j, :, :] = image
-
-        return final_tensor
+        # broadcast over frames and append an empty 4th channel
+        image = image.unsqueeze(2).expand(-1, -1, max_frames, -1, -1)
+        return torch.cat([image, torch.zeros_like(image[:, :1])], dim=1)
     
-    def process(self, text_emb: torch.Tensor, text_emb_neg: torch.Tensor, image_path: str = None, initial_alpha: float = 0.23, ratio: float = 0.8, max_frames: int = 16) -> torch.Tensor:
+    def process(self, text_emb: torch.Tensor, text_emb_neg: torch.Tensor, image_path: str | np.ndarray | Image.Image = None, initial_alpha: float = 0.23, ratio: float = 0.8, max_frames: int = 16, decode_chunk_size: int = 4, save_previews: bool = False, seed: int | None = None) -> torch.Tensor:
+        # without an explicit seed, draw one from the global RNG so torch.manual_seed() still makes runs reproducible
+        self._gen.manual_seed(int(torch.randint(2**63 - 1, (1,))) if seed is None else seed)
         context = torch.cat([text_emb_neg, text_emb], dim=0).to(self.device)
         # synthesis
         with torch.no_grad():
@@ -138,88 +210,129 @@ class SDVideo:
             latent_h, latent_w = 32, 32
 
             # Create noise tensor shape (1, 4, self.max_frames, latent_h, latent_w)
-            input_noise_tensor = torch.randn(num_sample, 4, max_frames, latent_h, latent_w).to(self.device)
+            input_noise_tensor = torch.randn(num_sample, 4, max_frames, latent_h, latent_w, device=self.device, generator=self._gen)
 
             # Load and preprocess the image
             image_tensor = self.preprocess_image_RGB(image_path, (latent_w, latent_h), self.device, max_frames)
             print("Image weight "+str(initial_alpha)+"x"+str(ratio)+" Tensor size: "+str(image_tensor.size()))
             print("Processing video "+str(max_frames)+" frames...")
 
-            ## Calculate mean and std for the image tensor
-            image_mean = image_tensor.mean(dim=[0, 2, 3], keepdim=True)
-            image_std = image_tensor.std(dim=[0, 2, 3], keepdim=True)
-
-            # Normalize the image tensor
-            normalized_image_tensor = (image_tensor - image_mean) / image_std
-
-            # Create a new tensor with the same shape as input_noise_tensor
-            combined_tensor = input_noise_tensor.clone()
-            
-            # Update the combined tensor with image data for the first three channels (RGB) for all frames
-            combined_tensor[:, :3, :, :, :] = normalized_image_tensor[:, :3, :, :, :]
-            
             # Add noise to the first three channels of the combined tensor
-            noise_tensor = torch.randn_like(combined_tensor)
-            
+            noise_tensor = torch.randn(input_noise_tensor.shape, device=self.device, dtype=input_noise_tensor.dtype, generator=self._gen)
+
             # Blend noise tensor and image tensor using a blending factor (alpha) that changes per frame
-            initial_alpha = initial_alpha  # Initial blending factor (0 <= alpha <= 1)
-            ratio = ratio  # Define the ratio to reduce alpha per frame
             alphas = [initial_alpha * (ratio ** i) for i in range(max_frames)]
-            # Create the blended tensor
-            blended_tensors = []
-            for i in range(max_frames):
-                alpha = alphas[i]
-                blended_frame = alpha * combined_tensor[:, :, i, :, :] + (1 - alpha) * noise_tensor[:, :, i, :, :]
-                blended_tensors.append(blended_frame.unsqueeze(2))
-            blended_tensor = torch.cat(blended_tensors, dim=2)
-
-            # Calculate mean and std for the blended tensor
-            blended_mean = blended_tensor.mean(dim=[0, 2, 3], keepdim=True)
-            blended_std = blended_tensor.std(dim=[0, 2, 3], keepdim=True)
-            # Normalize the blended tensor
-            normalized_blended_tensor = (blended_tensor - blended_mean) / blended_std
-            
+            alphas_t = torch.tensor(alphas, device=self.device, dtype=input_noise_tensor.dtype).view(1, 1, max_frames, 1, 1)
+            normalized_blended_tensor = self._prepare_noise(image_tensor, input_noise_tensor, noise_tensor, alphas_t)
+
             # Save noise preview
-            self.save_noise(normalized_blended_tensor, max_frames)
-
-            with torch.autocast(self.device.type, enabled=True):
-                x0 = self.diffusion.ddim_sample_loop(
-                    noise=normalized_blended_tensor,
-                    model=self.unet,
-                    model_kwargs=[{
-                        'y': context[1].unsqueeze(0).repeat(num_sample, 1, 1)
-                    }, {
-                        'y': context[0].unsqueeze(0).repeat(num_sample, 1, 1)
-                    }],
-                    guide_scale=9.0,
-                    ddim_timesteps=50,
-                    eta=0.0
-                )
-
-                scale_factor = 0.18215
-                video_data = 1. / scale_factor * x0
-                bs_vd = video_data.shape[0]
-                video_data = rearrange(video_data, 'b c f h w -> (b f) c h w')
-                self.vae.to(self.device)
-                video_data = self.vae.decode(video_data)
-                video_data = rearrange(
-                    video_data, '(b f) c h w -> b c f h w', b=bs_vd)
+            if save_previews:
+                self.save_noise(normalized_blended_tensor, max_frames)
+
+            # latents stay fp32 for the DDIM arithmetic, the UNet casts to its own dtype
+            normalized_blended_tensor = normalized_blended_tensor.contiguous(memory_format=torch.channels_last_3d)
+            x0 = self.diffusion.ddim_sample_loop(
+                noise=normalized_blended_tensor,
+                model=self.unet,
+                model_kwargs=[{
+                    'y': context[1].unsqueeze(0).repeat(num_sample, 1, 1)
+                }, {
+                    'y': context[0].unsqueeze(0).repeat(num_sample, 1, 1)
+                }],
+                guide_scale=9.0,
+                ddim_timesteps=50,
+                eta=0.0
+            )
+
+            scale_factor = 0.18215
+            video_data = 1. / scale_factor * x0
+            bs_vd = video_data.shape[0]
+            video_data = rearrange(video_data, 'b c f h w -> (b f) c h w').contiguous(memory_format=torch.channels_last)
+            video_data = self.decode_latents(video_data.to(self.dtype), decode_chunk_size)
+            video_data = rearrange(
+                video_data, '(b f) c h w -> b c f h w', b=bs_vd)
+        if save_previews:
+            self.wait_for_previews()
         return video_data
 
+    def decode_latents(self, latents: torch.Tensor, chunk_size: int = 4) -> torch.Tensor:
+        # Decode (b f) c h w latents a few frames at a time to cap the VAE's peak memory
+        n = latents.shape[0]
+        decoded = None
+        for i in range(0, n, chunk_size):
+            chunk = latents[i:i + chunk_size]
+            valid = chunk.shape[0]
+            if valid < chunk_size and self._vae_compiled:
+                # pad the last chunk so the compiled decoder always sees the same shape
+                chunk = torch.cat([chunk, chunk[-1:].expand(chunk_size - valid, -1, -1, -1)])
+            chunk = self.vae.decode(chunk.contiguous(memory_format=torch.channels_last))[:valid]
+            if decoded is None:
+                decoded = torch.empty((n, *chunk.shape[1:]), dtype=torch.float32, device=chunk.device)
+            decoded[i:i + valid] = chunk
+        return decoded
+
+    def _prepare_noise(self, image_tensor: torch.Tensor, input_noise_tensor: torch.Tensor, noise_tensor: torch.Tensor, alphas: torch.Tensor) -> torch.Tensor:
+        # Normalize the image tensor
+        image_mean = image_tensor.mean(dim=[0, 2, 3], keepdim=True)
+        image_std = image_tensor.std(dim=[0, 2, 3], keepdim=True)
+        normalized_image_tensor = (image_tensor - image_mean) / image_std
+
+        # Image data for the first three channels (RGB) for all frames, input noise for the rest
+        combined_tensor = torch.cat([normalized_image_tensor[:, :3], input_noise_tensor[:, 3:]], dim=1)
+
+        # Blend, broadcasting the per-frame alphas of shape (1, 1, f, 1, 1) over (b, c, f, h, w)
+        blended_tensor = alphas * combined_tensor + (1 - alphas) * noise_tensor
+
+        # Normalize the blended tensor. Not a no-op: blending two unit-variance tensors leaves
+        # alpha^2 + (1 - alpha)^2 variance, and DDIM expects unit-variance noise. The statistics
+        # pool over batch, frames and height (dims 0, 2, 3), so this rescales the whole clip per
+        # channel and width column rather than each frame on its own
+        blended_mean = blended_tensor.mean(dim=[0, 2, 3], keepdim=True)
+        blended_std = blended_tensor.std(dim=[0, 2, 3], keepdim=True)
+        return (blended_tensor - blended_mean) / blended_std
+
     def pil_img_to_torch(self, pil_img, half=False):
-        image = np.array(pil_img).astype(np.float32) / 255.0
-        image = rearrange(torch.from_numpy(image), 'h w c -> c h w')
+        # uint8 (c, h, w) straight from PIL, then one scale/shift to [-1, 1]
+        image = TF.pil_to_tensor(pil_img).to(self.device, dtype=torch.float32) / 127.5 - 1.0
         if half:
             image = image.half()
-        return (2.0 * image - 1.0).unsqueeze(0)
+        return image.unsqueeze(0)
     
     def save_noise(self, input_noise_tensor: torch.Tensor, max_frames: int = 16):
+        # Read back the first 3 channels (RGB), on a side stream when on GPU so the copy overlaps DDIM.
+        # Clone on the current stream first: the input may be a CUDA-graph output whose memory the
+        # next graph replay reuses, which record_stream does not guard against
+        frames = input_noise_tensor[0, :3].detach().clone()
+        copied = None
+        if frames.is_cuda:
+            stream = torch.cuda.Stream(device=frames.device)
+            stream.wait_stream(torch.cuda.current_stream(frames.device))
+            with torch.cuda.stream(stream):
+                frames.record_stream(stream)
+                cpu_frames = torch.empty(frames.shape, dtype=frames.dtype, pin_memory=True)
+                cpu_frames.copy_(frames, non_blocking=True)
+                copied = torch.cuda.Event()
+                copied.record(stream)
+        else:
+            cpu_frames = frames
+        self.wait_for_previews()
+        self._preview_future = self._preview_executor.submit(self._write_noise_previews, cpu_frames, copied, max_frames)
+
+    def wait_for_previews(self) -> None:
+        # Block on the pending preview writes, re-raising any error from the background thread
+        if self._preview_future is not None:
+            future, self._preview_future = self._preview_future, None
+            future.result()
+
+    def _write_noise_previews(self, frames: torch.Tensor, copied: torch.cuda.Event | None, max_frames: int = 16):
         # Save preview image for each frame
-        preview_dir = os.getcwd()
+        if copied is not None:
+            copied.synchronize()
+        preview_dir = os.path.join(os.getcwd(), 'noise')
+        os.makedirs(preview_dir, exist_ok=True)
         for j in range(max_frames):
-            frame_preview_path = os.path.join(preview_dir, f'noise/preview_frame_{j}.png')
-            frame_data = input_noise_tensor[0, :3, j, ...].squeeze()  # Get the first 3 channels (RGB)
-            vutils.save_image(frame_data, frame_preview_path, normalize=True)
+            frame_preview_path = os.path.join(preview_dir, f'preview_frame_{j}.png')
+            vutils.save_image(frames[:, j], frame_preview_path, normalize=True)
 
     def print_pixel_values(self, tensor: torch.Tensor, tensor_name: str, num_channels: int = 4, frame_idx: int = 0):
         print(f"Pixel values for {tensor_name}:")
@@ -229,17 +342,12 @@ class SDVideo:
 
     def save_webm(self, images: torch.Tensor, file_path: str, fps: int = 24) -> None:
         print("Saving video as "+file_path)
-        images = images.mul(255).round().clamp(0, 255).to(dtype=torch.uint8, device='cpu').numpy()
-        frames = [Image.fromarray(x) for x in images]
+        if images.dtype != torch.uint8:
+            images = images.mul(255).round().clamp(0, 255).to(dtype=torch.uint8)
+        images = to_host(images)
+        write_webm(images, file_path, fps)
 
-        # Save the video as a WebM file
-        with imageio.get_writer(file_path, format='WEBM', mode='I', fps=fps, codec='vp9') as writer:
-            for frame in frames:
-                # Convert the PIL.Image object to a NumPy array
-                frame_array = np.array(frame)
-                writer.append_data(frame_array)
-
-    def process_multiline_prompt(self, multiline_prompt: str, image_path: str, max_frames: int = 16, initial_alpha: float = 0.23, ratio: float = 0.8, output_file_path: str = "output.webm", fps: int = 16) -> str:
+    def process_multiline_prompt(self, multiline_prompt: str, image_path: str | np.ndarray | Image.Image, max_frames: int = 16, initial_alpha: float = 0.23, ratio: float = 0.8, output_file_path: str = "output.webm", fps: int = 16, seed: int | None = None, decode_chunk_size: int = 4) -> str:
         # Split the multiline_prompt into individual lines
         prompts = multiline_prompt.split("\n")
 
@@ -247,32 +355,41 @@ class SDVideo:
         all_frames = []
 
         # Iterate through each prompt
-        for prompt in prompts:
-            # Generate a video for the current prompt
-            self.__call__(prompt, max_frames=max_frames, initial_alpha=initial_alpha, ratio=ratio, image_path=image_path, output_file_path=output_file_path, fps=fps)
-
-            # Load the generated video
-            video_frames = imageio.mimread(output_file_path)
+        for i, prompt in enumerate(prompts):
+            # Generate a video for the current prompt, keeping the frames in memory
+            text_emb, text_emb_neg = self.preprocess(prompt)
+            print("Processing: "+prompt)
+            y = self.process(text_emb, text_emb_neg, image_path, initial_alpha, ratio, max_frames, decode_chunk_size=decode_chunk_size, seed=None if seed is None else seed + i)
+            video_frames = to_host(self.postprocess(y))
 
             # Append the frames of the current video to the all_frames list
-            all_frames.extend(video_frames)
+            all_frames.append(video_frames)
 
-            # Update the image_path for the next prompt to use the last frame of the current video
-            last_frame = Image.fromarray(video_frames[-1])
-            last_frame.save("temp_last_frame.png")
-            image_path = "temp_last_frame.png"
+            # Start the next prompt from the last frame of the current video
+            image_path = video_frames[-1]
 
         # Save the concatenated video
-        with imageio.get_writer(output_file_path, format='WEBM', mode='I', fps=fps, codec='vp9') as writer:
-            for frame in all_frames:
-                writer.append_data(frame)
-
-        # Remove the temporary last frame image
-        if os.path.exists("temp_last_frame.png"):
-            os.remove("temp_last_frame.png")
+        write_webm(np.concatenate(all_frames), output_file_path, fps)
 
         return "complete"
 
+def to_host(images: torch.Tensor) -> np.ndarray:
+    # async D2H copy into pinned memory, synced once before numpy reads it.
+    # A fresh buffer each call, since the returned array aliases it
+    if not images.is_cuda:
+        return images.numpy()
+    host = torch.empty(images.shape, dtype=images.dtype, pin_memory=True)
+    host.copy_(images, non_blocking=True)
+    torch.cuda.current_stream(images.device).synchronize()
+    return host.numpy()
+
+def write_webm(frames: np.ndarray, file_path: str, fps: int = 24) -> None:
+    # frames: uint8 array of shape (f, h, w, 3), handed to the ffmpeg writer without a PIL round-trip
+    frames = np.ascontiguousarray(frames, dtype=np.uint8)
+    with imageio.get_writer(file_path, format='WEBM', mode='I', fps=fps, codec='vp9', macro_block_size=1) as writer:
+        for frame in frames:
+            writer.append_data(frame)
+
 def tensor2vid(
         video: torch.Tensor,
         mean: tuple[float, float, float] | float = (0.5, 0.5, 0.5),
@@ -284,14 +401,31 @@ def tensor2vid(
         std = (std,) * 3
     mean = torch.tensor(mean, device = video.device).reshape(1, -1, 1, 1, 1)  # n c f h w
     std = torch.tensor(std, device=video.device).reshape(1, -1, 1, 1, 1)  # n c f h w
-    video = video.mul_(std).add_(mean)
+    if ENABLE_TORCH_COMPILATION and video.is_cuda:
+        video = _compiled_to_uint8_vid()(video, mean, std)
+    else:
+        video = to_uint8_vid(video, mean, std)
     images = rearrange(video, 'i c f h w -> f h (i w) c')  # f h w c
     return images
 
+def to_uint8_vid(video: torch.Tensor, mean: torch.Tensor, std: torch.Tensor) -> torch.Tensor:
+    # de-normalize and quantize in one pass, fused into a single kernel when compiled
+    return ((video * std + mean) * 255).round_().clamp_(0, 255).to(torch.uint8)
+
+_to_uint8_vid_compiled = None
+
+def _compiled_to_uint8_vid():
+    # built on first CUDA use so importing this module never sets up dynamo
+    global _to_uint8_vid_compiled
+    if _to_uint8_vid_compiled is None:
+        _to_uint8_vid_compiled = torch.compile(to_uint8_vid, dynamic=False)
+    return _to_uint8_vid_compiled
+
 def save_webm(images: torch.Tensor, dir_path: str, file_name: str, fps: int = 24) -> None:
     print("Saving video as "+file_name)
-    images = images.mul(255).round().clamp(0, 255).to(dtype=torch.uint8, device='cpu').numpy()
-    frames = [Image.fromarray(x) for x in images]
+    if images.dtype != torch.uint8:
+        images = images.mul(255).round().clamp(0, 255).to(dtype=torch.uint8)
+    images = to_host(images)
 
     # Join the directory and file name to form the full file path
     file_path = os.path.join(dir_path, file_name)
@@ -300,8 +434,4 @@ def save_webm(images: torch.Tensor, dir_path: str, file_name: str, fps: int = 24
     os.makedirs(dir_path, exist_ok=True)
 
     # Save the video as a WebM file
-    with imageio.get_writer(file_path, format='WEBM', mode='I', fps=fps, codec='vp9') as writer:
-        for frame in frames:
-            # Convert the PIL.Image object to a NumPy array
-            frame_array = np.array(frame)
-            writer.append_data(frame_array)
\ No newline at end of file
+    write_webm(images, file_path, fps)
\ No newline at end of file
@@ -60,6 +60,7 @@ class UNetSD(nn.Module):
         self.use_image_dataset = use_image_dataset
         self.use_fps_condition = use_fps_condition
         self.use_sim_mask = use_sim_mask
+        self.memory_format = torch.contiguous_format
         use_linear_in_temporal = False
         transformer_depth = 1
         disabled_sa = False
@@ -261,6 +262,9 @@ class UNetSD(nn.Module):
         """
         batch, device = x.shape[0], x.device
         self.batch = batch
+        # run in the weights' dtype, hand back the caller's dtype
+        x_dtype, dtype = x.dtype, self.time_embed[0].weight.dtype
+        x = x.to(dtype)
 
         # image and video joint training, if mask_last_frame_num is set, prob_focus_present will be ignored
         if mask_last_frame_num > 0:
@@ -275,11 +279,11 @@ class UNetSD(nn.Module):
         # embeddings
         if self.use_fps_condition and fps is not None:
             e = self.time_embed(sinusoidal_embedding(
-                t, self.dim)) + self.fps_embedding(
-                    sinusoidal_embedding(fps, self.dim))
+                t, self.dim).to(dtype)) + self.fps_embedding(
+                    sinusoidal_embedding(fps, self.dim).to(dtype))
         else:
-            e = self.time_embed(sinusoidal_embedding(t, self.dim))
-        context = y
+            e = self.time_embed(sinusoidal_embedding(t, self.dim).to(dtype))
+        context = y.to(dtype)
 
         # repeat f times for spatial e and context
         f = x.shape[2]
@@ -288,6 +292,7 @@ class UNetSD(nn.Module):
 
         # always in shape (b f) c h w, except for temporal layer
         x = rearrange(x, 'b c f h w -> (b f) c h w')
+        x = x.contiguous(memory_format=self.memory_format)
         # encoder
         xs = []
         for block in self.input_blocks:
@@ -317,7 +322,27 @@ class UNetSD(nn.Module):
         x = self.out(x)
         # reshape back to (b c f h w)
         x = rearrange(x, '(b f) c h w -> b c f h w', b=batch)
-        return x
+        return x.to(x_dtype)
+
+    def to_channels_last(self) -> None:
+        r"""Store Conv2d weights as channels_last and Conv3d weights as channels_last_3d,
+        and keep the (b f) c h w activations in channels_last between blocks.
+        """
+        for m in self.modules():
+            if isinstance(m, nn.Conv2d):
+                m.weight.data = m.weight.data.contiguous(memory_format=torch.channels_last)
+            elif isinstance(m, nn.Conv3d):
+                m.weight.data = m.weight.data.contiguous(memory_format=torch.channels_last_3d)
+        self.memory_format = torch.channels_last
+
+    def compile_repeated_blocks(self, **compile_kwargs) -> None:
+        r"""Compile each repeated ResBlock/SpatialTransformer/TemporalTransformer
+        in place with torch.compile, instead of compiling the whole UNet.
+        Only `forward` is wrapped so `_forward_single`'s isinstance dispatch still works.
+        """
+        for m in self.modules():
+            if isinstance(m, (ResBlock, SpatialTransformer, TemporalTransformer)):
+                m.forward = torch.compile(m.forward, **compile_kwargs)
 
     def _forward_single(self,
                         module,
@@ -329,10 +354,10 @@ class UNetSD(nn.Module):
                         video_mask,
                         reference=None):
         if isinstance(module, ResidualBlock):
-            x = x.contiguous()
+            x = x.contiguous(memory_format=self.memory_format)
             x = module(x, e, reference)
         elif isinstance(module, ResBlock):
-            x = x.contiguous()
+            x = x.contiguous(memory_format=self.memory_format)
             x = module(x, e, self.batch)
         elif isinstance(module, SpatialTransformer):
             x = module(x, context)
@@ -406,22 +431,16 @@ class CrossAttention(nn.Module):
         k = self.to_k(context)
         v = self.to_v(context)
 
-        q, k, v = map(lambda t: rearrange(t, 'b n (h d) -> (b h) n d', h=h),
+        q, k, v = map(lambda t: rearrange(t, 'b n (h d) -> b h n d', h=h).contiguous(),
                       (q, k, v))
-        sim = torch.einsum('b i d, b j d -> b i j', q, k) * self.scale
-        del q, k
 
         if exists(mask):
-            mask = rearrange(mask, 'b ... -> b (...)')
-            max_neg_value = -torch.finfo(sim.dtype).max
-            mask = repeat(mask, 'b j -> (b h) () j', h=h)
-            sim.masked_fill_(~mask, max_neg_value)
+            mask = rearrange(mask, 'b ... -> b () () (...)')
 
         # attention, what we cannot get enough of
-        sim = sim.softmax(dim=-1)
-
-        out = torch.einsum('b i j, b j d -> b i d', sim, v)
-        out = rearrange(out, '(b h) n d -> b n (h d)', h=h)
+        out = F.scaled_dot_product_attention(
+            q, k, v, attn_mask=mask, is_causal=False, scale=self.scale)
+        out = rearrange(out, 'b h n d -> b n (h d)', h=h)
         return self.to_out(out)
 
 
@@ -996,13 +1015,11 @@ class AttentionBlock(nn.Module):
             k = torch.cat([ck, k], dim=-1)
             v = torch.cat([cv, v], dim=-1)
 
-        # compute attention
-        attn = torch.matmul(q.transpose(-1, -2) * self.scale, k * self.scale)
-        attn = F.softmax(attn, dim=-1)
-
-        # gather context
-        x = torch.matmul(v, attn.transpose(-1, -2))
-        x = x.reshape(b, c, h, w)
+        # compute attention and gather context, [B, N, D, L] -> [B, N, L, D] for sdpa
+        x = F.scaled_dot_product_attention(
+            q.transpose(-1, -2), k.transpose(-1, -2), v.transpose(-1, -2),
+            scale=self.scale**2)
+        x = x.transpose(-1, -2).reshape(b, c, h, w)
         # output
         x = self.proj(x)
         return x + identity